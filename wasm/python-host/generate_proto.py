@@ -2,10 +2,33 @@
 
 import subprocess
 import sys
+from importlib import resources
 from pathlib import Path
 import argparse
 
-def generate_proto(out_dir: Path | None = None):
+def _run_protoc(protoc_cmd: list[str]) -> None:
+    """Run protoc in-process via grpc_tools when installed, otherwise spawn the protoc binary"""
+    try:
+        from grpc_tools import protoc as grpc_protoc
+    except ImportError:
+        subprocess.run(protoc_cmd, check=True)
+        return
+
+    # grpc_tools bundles the google/protobuf well-known types matching its protoc version
+    well_known_protos = resources.files("grpc_tools") / "_proto"
+    argv = [protoc_cmd[0], f"--proto_path={well_known_protos}", *protoc_cmd[1:]]
+    returncode = grpc_protoc.main(argv)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, argv)
+
+def _is_up_to_date(proto_files: list[Path], out_files: list[Path]) -> bool:
+    """True when every generated file exists and is newer than all inputs (incl. this script)"""
+    if not all(out.exists() for out in out_files):
+        return False
+    in_mtime = max(p.stat().st_mtime for p in [*proto_files, Path(__file__)])
+    return min(out.stat().st_mtime for out in out_files) >= in_mtime
+
+def generate_proto(out_dir: Path | None = None, force: bool = False):
     """Generate Python protobuf files from proto definitions"""
 
     # Get the proto directory
@@ -42,7 +65,15 @@ def generate_proto(out_dir: Path | None = None):
     if confidence_types_proto.exists():
         proto_files.append(str(confidence_types_proto))
 
-    if proto_files:
+    # Expected outputs mirror each input's path below the proto root it was found in
+    out_files = []
+    for pf in proto_files:
+        root = proto_dir if Path(pf).is_relative_to(proto_dir) else confidence_protos_dir
+        out_files.append(python_proto_dir / Path(pf).relative_to(root).with_name(f"{Path(pf).stem}_pb2.py"))
+
+    if proto_files and not force and _is_up_to_date([Path(pf) for pf in proto_files], out_files):
+        print(f"Protobuf files up-to-date in {python_proto_dir}")
+    elif proto_files:
         # Build protoc command with multiple proto paths
         protoc_cmd = [
             "protoc",
@@ -62,7 +93,7 @@ def generate_proto(out_dir: Path | None = None):
         
         protoc_cmd.extend(proto_files)
         
-        subprocess.run(protoc_cmd, check=True)
+        _run_protoc(protoc_cmd)
         print(f"Generated {len(proto_files)} proto file(s)")
         for pf in proto_files:
             print(f"  - {Path(pf).name}")
@@ -88,6 +119,7 @@ def generate_proto(out_dir: Path | None = None):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate Python protobuf files")
     parser.add_argument("--out", dest="out", type=str, default=None, help="Output directory for generated code")
+    parser.add_argument("--force", action="store_true", help="Regenerate even if outputs are up-to-date")
     args = parser.parse_args()
     out_dir = Path(args.out) if args.out else None
-    generate_proto(out_dir)
\ No newline at end of file
+    generate_proto(out_dir, force=args.force)
\ No newline at end of file
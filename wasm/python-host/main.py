@@ -2,7 +2,12 @@
 
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+
+# Prefer the native upb protobuf backend; must be set before google.protobuf is imported
+os.environ.setdefault("PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION", "upb")
+
 from google.protobuf.struct_pb2 import Struct
 import proto.resolver.api_pb2 as api_pb2
 import proto.types_pb2 as types_pb2
@@ -23,10 +28,15 @@ def main():
         print(f"Resolver state file not found: {resolver_state_path}")
         sys.exit(1)
 
-    resolver_state = resolver_state_path.read_bytes()
+    # Read both inputs concurrently; they are independent files
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        wasm_future = executor.submit(wasm_path.read_bytes)
+        resolver_state_future = executor.submit(resolver_state_path.read_bytes)
+        wasm_bytes = wasm_future.result()
+        resolver_state = resolver_state_future.result()
 
-    # Create resolver API
-    api = ResolverApi(wasm_path.read_bytes())
+    # Create resolver API, caching the compiled module between runs
+    api = ResolverApi(wasm_bytes, cache_dir=Path(__file__).parent / ".wasm-cache")
 
     # Set resolver state
     try:
@@ -37,8 +47,10 @@ def main():
 
     # Verify MATCH reason and non-empty variant for tutorial_visitor
     verify_ctx = Struct()
-    verify_ctx.fields["targeting_key"].string_value = "tutorial_visitor"
-    verify_ctx.fields["visitor_id"].string_value = "tutorial_visitor"
+    verify_ctx.update({
+        "targeting_key": "tutorial_visitor",
+        "visitor_id": "tutorial_visitor",
+    })
     verify_req = api_pb2.ResolveFlagsRequest(
         client_secret="mkjJruAATQWjeY7foFIWfVAcBWnci2YF",
         apply=False,
@@ -57,17 +69,14 @@ def main():
         print("Expected non-empty variant for tutorial-feature")
         sys.exit(1)
     # Extract string title value
-    title_val = None
-    if rf.value and rf.value.fields:
-        if "title" in rf.value.fields and rf.value.fields["title"].HasField("string_value"):
-            title_val = rf.value.fields["title"].string_value
-        elif "value" in rf.value.fields and rf.value.fields["value"].HasField("string_value"):
-            title_val = rf.value.fields["value"].string_value
-        else:
-            for v in rf.value.fields.values():
-                if v.HasField("string_value"):
-                    title_val = v.string_value
-                    break
+    fields = rf.value.fields
+    # Prefer the well-known keys; `in` checks first so the map is never mutated by a lookup
+    for key in ("title", "value"):
+        if key in fields and fields[key].HasField("string_value"):
+            title_val = fields[key].string_value
+            break
+    else:
+        title_val = next((v.string_value for v in fields.values() if v.HasField("string_value")), None)
     print(f"tutorial-feature verified: reason=RESOLVE_REASON_MATCH variant={rf.variant} title={title_val}")
 
     # Done: single flag verified above
@@ -1,39 +1,168 @@
 #!/usr/bin/env python3
 
+import functools
+import hashlib
+import os
 import struct
+import time
+from pathlib import Path
 from typing import List, Dict, Any
 
 from google.protobuf import message
-from datetime import datetime
-from google.protobuf.timestamp_pb2 import Timestamp
-from wasmtime import Engine, Store, Module, Instance, Func, Config, ValType, FuncType, Linker
+from google.protobuf.internal import api_implementation
+from wasmtime import Engine, Store, Module, Instance, Func, Config, ValType, FuncType, Linker, WasmtimeError
 
 # Import generated protobuf modules
 from proto import messages_pb2
 from proto.resolver import api_pb2
 
+# Reads the little-endian u32 length prefix that precedes every guest buffer
+_read_u32 = struct.Struct("<I").unpack_from
+
+# Wire-format tags of the messages.Request/Response envelopes (length-delimited fields)
+_DATA_TAG = 0x0A  # field 1: data
+_ERROR_TAG = 0x12  # field 2: error (Response only)
+
+# Signature of every wasm_msg host import: request pointer in, response pointer out
+_I32 = ValType.i32()
+_FT_I32_I32 = FuncType([_I32], [_I32])
+
+
+def _encode_varint(value: int) -> bytes:
+    """Encode a non-negative integer as a protobuf base-128 varint"""
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _decode_varint(buf, pos: int) -> tuple[int, int]:
+    """Decode a protobuf varint at pos, returning (value, position after it)"""
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _field_payload(buf) -> memoryview:
+    """View of the payload of buf's leading length-delimited field (empty if buf is empty)"""
+    if not buf:
+        return memoryview(b"")
+    length, pos = _decode_varint(buf, 1)
+    return memoryview(buf)[pos:pos + length]
+
+
+def _len_field_header(field_number: int, length: int) -> bytes:
+    """Tag + varint length preceding a length-delimited (wire type 2) field"""
+    return bytes(((field_number << 3) | 2,)) + _encode_varint(length)
+
+
+def _envelope_header(tag: int, length: int) -> bytes:
+    """Tag byte + varint length preceding the payload of a single-field envelope"""
+    return bytes((tag,)) + _encode_varint(length)
+
+
 class ResolverApi:
     """Handles communication with the WASM module"""
 
-    def __init__(self, wasm_bytes: bytes):
-        # Create WASM engine and store
-        # Create config and enable fuel consumption
-        config = Config()
-        # config.consume_fuel = True
-        self.engine = Engine(config)
-        self.store = Store(self.engine)
+    # Engine + compiled module of the most recently loaded WASM, keyed by digest and shared
+    # by every instance built from it. Loading a different module replaces the entry, so old
+    # engines are only kept alive by the instances still using them.
+    _compiled: dict[str, tuple[Engine, Module]] = {}
+
+    # Fixed attribute layout: the hot paths read these on every call
+    __slots__ = (
+        "engine", "module", "store", "instance", "memory",
+        "wasm_msg_alloc", "wasm_msg_free", "wasm_msg_guest_set_resolver_state", "wasm_msg_guest_resolve",
+        "_alloc", "_free", "_guest_set_resolver_state", "_guest_resolve", "_applied_state",
+        "_view", "_view_len",
+    )
 
-        # Compile the WASM module
-        self.module = Module(self.engine, wasm_bytes)
+    def __init__(self, wasm_bytes: bytes, cache_dir: Path | None = None):
+        # Every call round-trips protobufs; refuse to run on the pure-Python backend
+        if api_implementation.Type() == "python":
+            raise RuntimeError(
+                "ResolverApi requires a native protobuf backend (upb or cpp), "
+                "but PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION resolved to 'python'"
+            )
+
+        # Reuse the process-wide engine and compiled module; only the store is per instance
+        self.engine, self.module = self._compile(wasm_bytes, cache_dir)
+        self.store = Store(self.engine)
 
         # Register host functions
         self._register_host_functions()
 
-        # Get exported functions
-        self.wasm_msg_alloc = self.instance.exports(self.store)["wasm_msg_alloc"]
-        self.wasm_msg_free = self.instance.exports(self.store)["wasm_msg_free"]
-        self.wasm_msg_guest_set_resolver_state = self.instance.exports(self.store)["wasm_msg_guest_set_resolver_state"]
-        self.wasm_msg_guest_resolve = self.instance.exports(self.store)["wasm_msg_guest_resolve"]
+        # Get exported functions and memory (looked up once, not per call)
+        exports = self.instance.exports(self.store)
+        self.memory = exports["memory"]
+        self.wasm_msg_alloc = exports["wasm_msg_alloc"]
+        self.wasm_msg_free = exports["wasm_msg_free"]
+        self.wasm_msg_guest_set_resolver_state = exports["wasm_msg_guest_set_resolver_state"]
+        self.wasm_msg_guest_resolve = exports["wasm_msg_guest_resolve"]
+
+        # Bind the exports to our store so hot paths make single-argument calls
+        self._alloc = functools.partial(self.wasm_msg_alloc, self.store)
+        self._free = functools.partial(self.wasm_msg_free, self.store)
+        self._guest_set_resolver_state = functools.partial(self.wasm_msg_guest_set_resolver_state, self.store)
+        self._guest_resolve = functools.partial(self.wasm_msg_guest_resolve, self.store)
+
+        # Last (state, account_id) accepted by the guest, used to skip no-op updates
+        self._applied_state = None
+
+        # Cached view over linear memory and the memory size it was taken at
+        self._view = None
+        self._view_len = -1
+
+    @classmethod
+    def _compile(cls, wasm_bytes: bytes, cache_dir: Path | None) -> tuple[Engine, Module]:
+        """Return the shared engine and compiled module for wasm_bytes, compiling at most once"""
+        # Key on the module contents so a rebuilt .wasm is never served stale
+        digest = hashlib.sha256(wasm_bytes).hexdigest()[:16]
+        compiled = cls._compiled.get(digest)
+        if compiled is None:
+            engine = Engine(Config())
+            compiled = (engine, cls._load_module(engine, wasm_bytes, digest, cache_dir))
+            cls._compiled.clear()
+            cls._compiled[digest] = compiled
+        return compiled
+
+    @staticmethod
+    def _load_module(engine: Engine, wasm_bytes: bytes, digest: str, cache_dir: Path | None) -> Module:
+        """Compile the WASM module, reusing an AOT-compiled artifact when available"""
+        if cache_dir is None:
+            return Module(engine, wasm_bytes)
+
+        cache_path = cache_dir / f"confidence_resolver-{digest}.cwasm"
+        if cache_path.exists():
+            try:
+                return Module.deserialize_file(engine, str(cache_path))
+            except WasmtimeError:
+                # Produced by an incompatible wasmtime version or config; recompile below
+                pass
+
+        module = Module(engine, wasm_bytes)
+        # Write atomically so concurrent processes never observe a partial artifact
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_bytes(module.serialize())
+            tmp_path.replace(cache_path)
+        except OSError:
+            # The cache is only an optimization (read-only checkout, full disk, ...);
+            # keep the freshly compiled module and just recompile next time
+            try:
+                tmp_path.unlink(missing_ok=True)
+            except OSError:
+                pass
+        return module
 
     def _register_host_functions(self):
         """Register host functions that can be called from WASM"""
@@ -41,32 +170,24 @@ class ResolverApi:
         def current_time(ptr: int) -> int:
             """Host function to return current timestamp"""
             try:
-                # Create timestamp
-                timestamp = Timestamp()
-                timestamp.FromDatetime(datetime.now())
+                # Release the (empty) Void request the guest allocated for this call
+                self._free(ptr)
 
-                # Create response wrapper
-                response = messages_pb2.Response()
-                response.data = timestamp.SerializeToString()
+                # Encode google.protobuf.Timestamp (seconds = 1, nanos = 2) from the UTC epoch clock
+                seconds, nanos = divmod(time.time_ns(), 1_000_000_000)
+                timestamp = b"\x08" + _encode_varint(seconds) + b"\x10" + _encode_varint(nanos)
 
                 # Transfer response to WASM memory
-                return self._transfer_response(response)
+                return self._transfer_response(timestamp)
             except Exception as e:
                 # Return error response
-                error_response = messages_pb2.Response()
-                error_response.error = str(e)
-                return self._transfer_response(error_response)
-
-        # # Register the host function
-        # self.store.set_fuel(1000000)  # Add fuel for execution
+                return self._transfer_error(str(e))
 
-        # Create function type: takes one i32 parameter, returns one i32
-        func_type = FuncType([ValType.i32()], [ValType.i32()])
-        host_func_time = Func(self.store, func_type, current_time)
+        host_func_time = Func(self.store, _FT_I32_I32, current_time)
 
         linker = Linker(self.store.engine)
 
-        # Define the import with module and name
+        # Define the imports with module and name
         linker.define(self.store, "wasm_msg", "wasm_msg_host_current_time", host_func_time)
 
         # Instantiate the module with imports
@@ -74,53 +195,89 @@ class ResolverApi:
 
     def set_resolver_state(self, state: bytes, account_id: str) -> None:
         """Set the resolver state in the WASM module"""
-        # Create SetResolverStateRequest proto
-        set_resolver_state_request = messages_pb2.SetResolverStateRequest()
-        set_resolver_state_request.state = state
-        set_resolver_state_request.account_id = account_id
+        # Skip the serialize + transfer + guest-side parse if nothing changed (the applied
+        # state is kept as an immutable copy, so buffers mutated in place are not skipped)
+        if self._applied_state == (state, account_id):
+            return
+        # Hand-encode SetResolverStateRequest (state = 1, account_id = 2): the state blob is
+        # copied once into the payload rather than into a message and again on serialization
+        account_id_bytes = account_id.encode("utf-8")
+        set_resolver_state_request = b"".join((
+            _len_field_header(1, len(state)), state,
+            _len_field_header(2, len(account_id_bytes)), account_id_bytes,
+        ))
         # Transfer request to WASM memory
         req_ptr = self._transfer_request(set_resolver_state_request)
         # Call the WASM function
-        results = self.wasm_msg_guest_set_resolver_state(self.store, req_ptr)
+        results = self._guest_set_resolver_state(req_ptr)
         resp_ptr = results
         # Consume the response
         self._consume_response(resp_ptr, lambda data: None)
+        self._applied_state = (bytes(state), account_id)
 
     def resolve(self, request: api_pb2.ResolveFlagsRequest) -> api_pb2.ResolveFlagsResponse:
         """Resolve flags using the WASM module"""
         # Transfer request to WASM memory
-        req_ptr = self._transfer_request(request)
-        # Call the WASM function
-        results = self.wasm_msg_guest_resolve(self.store, req_ptr)
-        resp_ptr = results
+        req_ptr = self._transfer(_DATA_TAG, request.SerializeToString())
+        # Call the WASM function; the guest frees the request buffer
+        resp_ptr = self._guest_resolve(req_ptr)
         # Consume the response
-        response = self._consume_response(resp_ptr, lambda data: self._parse_resolve_response(data))
-        return response
-
-    def _transfer_request(self, message: message.Message) -> int:
-        """Transfer a protobuf message to WASM memory"""
-        data = message.SerializeToString()
-        request = messages_pb2.Request()
-        request.data = data
-        return self._transfer(request.SerializeToString())
-
-    def _transfer_response(self, message: message.Message) -> int:
-        """Transfer a response to WASM memory"""
-        return self._transfer(message.SerializeToString())
-
-    def _transfer(self, data: bytes) -> int:
-        """Allocate memory in WASM and copy data"""
+        return self._consume_response(resp_ptr, self._parse_resolve_response)
+
+    def _transfer_request(self, message: message.Message | bytes | bytearray | memoryview) -> int:
+        """Transfer a protobuf message, or its already serialized bytes, to WASM memory"""
+        if isinstance(message, (bytes, bytearray)):
+            payload = message
+        elif isinstance(message, memoryview):
+            # Byte-wise view so len() is the payload size whatever the source format
+            payload = message.cast("B")
+        else:
+            payload = message.SerializeToString()
+        # Hand-encode the messages.Request envelope instead of serializing a wrapper message
+        return self._transfer(_DATA_TAG, payload)
+
+    def _transfer_response(self, data: bytes) -> int:
+        """Transfer a successful response payload to WASM memory"""
+        return self._transfer(_DATA_TAG, data)
+
+    def _transfer_error(self, error: str) -> int:
+        """Transfer an error response to WASM memory"""
+        return self._transfer(_ERROR_TAG, error.encode("utf-8"))
+
+    def _transfer(self, tag: int, payload: bytes) -> int:
+        """Allocate memory in WASM and write payload framed as a single envelope field"""
+        header = _envelope_header(tag, len(payload))
+        start = len(header)
         # Allocate memory in WASM
-        memory = self.instance.exports(self.store)["memory"]
-        results = self.wasm_msg_alloc(self.store, len(data))
-        # Write data to WASM memory
-        memory.write(self.store, data, results)
+        results = self._alloc(start + len(payload))
+        # Write header and payload straight into linear memory, without an intermediate
+        # concatenated copy; the view is taken after alloc since that may grow memory
+        view = self._memory_view()
+        view[results:results + start] = header
+        view[results + start:results + start + len(payload)] = payload
 
         return results
 
     def _consume_response(self, addr: int, codec) -> Any:
         """Consume a response from WASM memory"""
-        data = self._consume(addr)
+        # Hand the codec a view into linear memory (no host-side slice copy) and free only once
+        # it is done; the protobuf backend may still copy the view internally while parsing
+        data = self._borrow(addr)
+        try:
+            return self._decode_response(data, codec)
+        finally:
+            self._free(addr)
+
+    def _decode_response(self, data, codec) -> Any:
+        """Unwrap a messages.Response envelope, raising on error and decoding data with codec"""
+        # The guest writes exactly one envelope field; peek at its tag instead of parsing a Response
+        if data and data[0] in (_DATA_TAG, _ERROR_TAG):
+            payload = _field_payload(data)
+            if data[0] == _ERROR_TAG:
+                raise Exception(f"WASM error: {bytes(payload).decode('utf-8')}")
+            return codec(payload)
+
+        # Anything else (e.g. an empty envelope) goes through the generated parser
         response = messages_pb2.Response()
         response.ParseFromString(data)
 
@@ -129,22 +286,39 @@ class ResolverApi:
         resp = codec(response.data)
         return resp
 
-    def _consume(self, addr: int) -> bytes:
+    def _consume(self, addr: int) -> bytearray:
         """Read data from WASM memory and free it"""
-        # Read length (assuming 4-byte length prefix)
-        memory = self.instance.exports(self.store)["memory"]
-        len_bytes = memory.read(self.store, addr - 4, addr)
-        total_len = int.from_bytes(len_bytes, byteorder='little')
-        length = total_len - 4
-
-        # Read data
-        data = memory.read(self.store, addr, addr + length)
+        # Copy the payload out with a single slice copy
+        data = bytearray(self._borrow(addr))
         # Free memory
-        self.wasm_msg_free(self.store, addr)
+        self._free(addr)
 
         return data
 
-    def _parse_resolve_response(self, data: bytes) -> api_pb2.ResolveFlagsResponse:
+    def _borrow(self, addr: int) -> memoryview:
+        """Zero-copy view of the guest buffer at addr; valid until it is freed or memory grows"""
+        view = self._memory_view()
+        size = len(view)
+        if not 4 <= addr <= size:
+            raise IndexError(f"WASM buffer address {addr} is out of bounds")
+        # Read length (assuming 4-byte length prefix) in place
+        total_len = _read_u32(view, addr - 4)[0]
+        length = total_len - 4
+        if length < 0 or addr + length > size:
+            raise IndexError(f"WASM buffer at {addr} (length {length}) is out of bounds")
+        return view[addr:addr + length]
+
+    def _memory_view(self) -> memoryview:
+        """Zero-copy view over the whole WASM linear memory"""
+        # Linear memory only moves or resizes on memory.grow, so the cached view stays valid
+        # until the size changes; checking it is much cheaper than rebuilding the view
+        size = self.memory.data_len(self.store)
+        if size != self._view_len:
+            self._view = memoryview(self.memory.get_buffer_ptr(self.store, size)).cast("B")
+            self._view_len = size
+        return self._view
+
+    def _parse_resolve_response(self, data: memoryview) -> api_pb2.ResolveFlagsResponse:
         """Parse resolve response from protobuf data"""
         # Parse the protobuf bytes into ResolveFlagsResponse
         resolve_response = api_pb2.ResolveFlagsResponse()